@@ -46,6 +46,13 @@ REST_FRAMEWORK = {
     'PAGE_SIZE': 10
 }
 
+# Delta sync tokens are issued this far in the past, to cover writes that were
+# stamped before a sync but committed after it (hauto.views.DeltaSyncMixin).
+SYNC_TOKEN_MARGIN_SECONDS = 5
+
+# Records per delta sync response; clients page through the rest.
+SYNC_PAGE_SIZE = 500
+
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -84,9 +91,23 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
-    }
+    },
+    # Stand-in read replica for local testing of the replica routing.
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'db.replica.sqlite3'),
+    },
 }
 
+# Writes go to 'default'; safe-method API reads go to these aliases 
+# (hauto.routers). Empty: everything reads from 'default'.
+DATABASE_REPLICAS = []
+
+# After a write, read that user's requests from 'default' for this long.
+REPLICA_PIN_SECONDS = 5
+
+DATABASE_ROUTERS = ['hauto.routers.PrimaryReplicaRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.1/ref/settings/#auth-password-validators
@@ -0,0 +1,51 @@
+"""
+API-only settings for worker processes serving device clients.
+
+Same project as HomeAutomation.settings, minus everything only the browser 
+needs: admin, sessions, messages, staticfiles, their middleware, templates 
+and the browsable API. Clients speak JSON and authenticate with HTTP Basic.
+
+    DJANGO_SETTINGS_MODULE=HomeAutomation.settings_api
+    (or point the WSGI server at HomeAutomation.wsgi_api:application)
+
+This trims per-request work, not cold start: almost all of a worker's start-up
+is importing Django and DRF, which this profile needs as much as the full one.
+See benchmarks/bench_startup.py.
+"""
+
+from HomeAutomation.settings import *  # noqa: F401,F403
+from HomeAutomation.settings import REST_FRAMEWORK
+
+
+INSTALLED_APPS = [
+    'django.contrib.auth',
+    'django.contrib.contenttypes',
+    'rest_framework',
+    'hauto.apps.HautoConfig',
+]
+
+# No sessions, so no CSRF/auth/messages middleware either: DRF authenticates
+# every request itself.
+MIDDLEWARE = [
+    'django.middleware.security.SecurityMiddleware',
+    'django.middleware.common.CommonMiddleware',
+]
+
+ROOT_URLCONF = 'HomeAutomation.urls_api'
+
+TEMPLATES = []
+
+WSGI_APPLICATION = 'HomeAutomation.wsgi_api.application'
+
+REST_FRAMEWORK = dict(
+    REST_FRAMEWORK,
+    DEFAULT_RENDERER_CLASSES=(
+        'rest_framework.renderers.JSONRenderer',
+    ),
+    DEFAULT_PARSER_CLASSES=(
+        'rest_framework.parsers.JSONParser',
+    ),
+    DEFAULT_AUTHENTICATION_CLASSES=(
+        'rest_framework.authentication.BasicAuthentication',
+    ),
+)
@@ -0,0 +1,6 @@
+from django.conf.urls import url, include
+
+# API-only URL conf (HomeAutomation.settings_api): no browsable API login views.
+urlpatterns = [
+    url(r'^', include('hauto.urls')),
+]
@@ -0,0 +1,76 @@
+'''
+Benchmark: onboarding houses with rooms one request at a time vs. the bulk endpoint.
+
+    python benchmarks/bench_bulk_onboarding.py [houses] [rooms_per_house]
+
+Runs against a throwaway test database (never db.sqlite3). The "one by one" 
+figure replays what the per-object endpoints do at the ORM level: create the 
+house, create every room, then save the house again to attach them.
+'''
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'HomeAutomation.settings')
+
+import django
+django.setup()
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import setup_test_environment
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from hauto.models import House, Room
+
+
+def payload(houses, rooms_per_house):
+    return [
+        {'street_address': '%d London st' % h, 'city': 'St. Catharines', 'country': 'Canada',
+         'furnace_temperature': 30.0, 'furnace_status': 'HEAT',
+         'rooms': [{'room_label': 'room%d' % r, 'room_temperature': 20 + (r % 10)}
+                   for r in range(rooms_per_house)]}
+        for h in range(houses)
+    ]
+
+
+def one_by_one(owner, data):
+    for item in data:
+        item = dict(item)
+        rooms = item.pop('rooms')
+        house = House.objects.create(owner=owner, **item)
+        for room in rooms:
+            Room.objects.create(owner=owner, house=house, **room)
+        house.save()
+
+
+def bulk(owner, data):
+    client = APIClient()
+    client.force_authenticate(user=owner)
+    response = client.post(reverse('house-bulk'), data, format='json')
+    assert response.status_code == 201, response.data
+
+
+def main():
+    houses = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    rooms_per_house = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    data = payload(houses, rooms_per_house)
+
+    setup_test_environment()
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0)
+    try:
+        for name, run in (('one by one', one_by_one), ('bulk endpoint', bulk)):
+            owner = User.objects.create_user(username=name.replace(' ', '_'), password='nimda123')
+            start = time.perf_counter()
+            run(owner, data)
+            elapsed = time.perf_counter() - start
+            print('%-14s %d houses x %d rooms: %.2fs' % (name, houses, rooms_per_house, elapsed))
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+if __name__ == '__main__':
+    main()
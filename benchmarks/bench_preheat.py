@@ -0,0 +1,78 @@
+'''
+Benchmark: the pre-heating batch job (hauto.preheat.plan_all) end to end.
+
+    python benchmarks/bench_preheat.py [houses] [rooms_per_house] [readings_per_room]
+
+Seeds a throwaway test database (never db.sqlite3) with synthetic houses, 
+rooms and temperature history, then times one full planning run: loading,
+learning rates, planning and writing every FurnacePlan.
+'''
+import os
+import random
+import sys
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'HomeAutomation.settings')
+
+import django
+django.setup()
+
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.test.utils import setup_test_environment
+from django.utils import timezone
+
+from hauto.models import FurnacePlan, House, Room, RoomTemperatureReading
+from hauto.preheat import plan_all
+
+
+def seed(houses, rooms_per_house, readings_per_room):
+    random.seed(0)
+    now = timezone.now()
+    owner = User.objects.create_user(username='bench', password='nimda123')
+    with transaction.atomic():
+        House.objects.bulk_create(
+            House(id=h, city='St. Catharines', owner=owner, furnace_status=House.OFF,
+                  furnace_temperature=Decimal(random.randint(150, 250)) / 10)
+            for h in range(1, houses + 1))
+        rooms = [Room(id=(h - 1) * rooms_per_house + r + 1, house_id=h, owner=owner,
+                      room_label='room%d' % r,
+                      room_temperature=Decimal(random.randint(180, 260)) / 10)
+                 for h in range(1, houses + 1) for r in range(rooms_per_house)]
+        Room.objects.bulk_create(rooms)
+        RoomTemperatureReading.objects.bulk_create(
+            RoomTemperatureReading(
+                room_id=room.id, house_id=room.house_id,
+                temperature=Decimal(random.randint(150, 260)) / 10,
+                recorded=now - timedelta(hours=readings_per_room - i))
+            for room in rooms for i in range(readings_per_room))
+
+
+def main():
+    houses = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    rooms_per_house = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    readings_per_room = int(sys.argv[3]) if len(sys.argv) > 3 else 3
+
+    setup_test_environment()
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0)
+    try:
+        start = time.perf_counter()
+        seed(houses, rooms_per_house, readings_per_room)
+        print('seeded %d houses x %d rooms x %d readings in %.1fs' % (
+            houses, rooms_per_house, readings_per_room, time.perf_counter() - start))
+
+        start = time.perf_counter()
+        planned = plan_all(timezone.now() + timedelta(hours=8))
+        elapsed = time.perf_counter() - start
+        assert planned == houses == FurnacePlan.objects.count()
+        print('planned %d houses in %.1fs' % (planned, elapsed))
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+if __name__ == '__main__':
+    main()
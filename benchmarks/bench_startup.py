@@ -0,0 +1,82 @@
+'''
+Benchmark: worker cold start and resident memory, full vs. API-only settings.
+
+    python benchmarks/bench_startup.py [runs]
+
+Every run is a fresh interpreter that builds the WSGI application and serves 
+one JSON request to the API root (no database access), as a new worker would,
+then times 200 more (warm) requests. Reports medians of the time to a ready 
+application, to the first response, per warm request, and the peak resident 
+set size.
+
+Cold start is dominated by importing Django and DRF themselves, which both 
+profiles need; expect the two to be within noise of each other there. The 
+API-only profile's saving is per request (no session, CSRF, messages or 
+clickjacking middleware).
+'''
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROFILES = (
+    ('full', 'HomeAutomation.settings', 'HomeAutomation.wsgi'),
+    ('api-only', 'HomeAutomation.settings_api', 'HomeAutomation.wsgi_api'),
+)
+
+WORKER = '''
+import importlib, io, json, resource, sys, time
+start = time.perf_counter()
+application = importlib.import_module(sys.argv[1]).application
+ready = time.perf_counter()
+environ = {
+    'REQUEST_METHOD': 'GET', 'PATH_INFO': '/', 'QUERY_STRING': '',
+    'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'HTTP_HOST': 'localhost',
+    'HTTP_ACCEPT': 'application/json', 'wsgi.url_scheme': 'http',
+    'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr,
+}
+def serve():
+    statuses = []
+    request = dict(environ, **{'wsgi.input': io.BytesIO()})
+    b''.join(application(request, lambda status, headers: statuses.append(status)))
+    assert statuses[0].startswith('200'), statuses
+serve()
+served = time.perf_counter()
+for _ in range(200):
+    serve()
+warm = (time.perf_counter() - served) / 200
+print(json.dumps({
+    'ready': ready - start,
+    'first_response': served - start,
+    'warm_request': warm,
+    'maxrss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    'modules': len(sys.modules),
+}))
+'''
+
+
+def run(settings, wsgi):
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings)
+    output = subprocess.check_output(
+        [sys.executable, '-c', WORKER, wsgi], cwd=ROOT, env=env)
+    return json.loads(output.decode())
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    print('%-9s %10s %16s %14s %12s %8s' % (
+        'profile', 'ready', 'first response', 'warm request', 'max RSS', 'modules'))
+    for name, settings, wsgi in PROFILES:
+        results = [run(settings, wsgi) for _ in range(runs)]
+        median = lambda key: statistics.median(r[key] for r in results)
+        print('%-9s %8.1fms %14.1fms %12.3fms %9.1f MB %8d' % (
+            name, median('ready') * 1000, median('first_response') * 1000,
+            median('warm_request') * 1000,
+            median('maxrss_kb') / 1024, median('modules')))
+
+
+if __name__ == '__main__':
+    main()
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class HautoConfig(AppConfig):
     name = 'hauto'
+
+    def ready(self):
+        # Register signal receivers.
+        from hauto import signals  # noqa: F401
@@ -0,0 +1,52 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+
+class Command(BaseCommand):
+    help = ('Plan furnace pre-heating for every house so rooms are at temperature by '
+            '--ready-by. Meant to run periodically (eg. from cron).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ready-by', 
+                            help='ISO-8601 timestamp. Defaults to the next 07:00.')
+        parser.add_argument('--window-days', type=int, default=14,
+                            help='Days of temperature history to learn from.')
+        parser.add_argument('--max-gap-hours', type=float,
+                            help='Ignore temperature changes over longer gaps between '
+                                 'readings (idle furnace). Defaults to 6.')
+        parser.add_argument('--prune', action='store_true',
+                            help='Delete temperature readings older than the window.')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS,
+                            help='Database to plan. Defaults to "default".')
+
+    def handle(self, *args, **options):
+        # NumPy is only needed here; keep it out of the web workers' imports.
+        from hauto.models import RoomTemperatureReading
+        from hauto.preheat import DEFAULT_MAX_GAP_HOURS, plan_all
+
+        now = timezone.localtime()
+        if options['ready_by']:
+            ready_by = parse_datetime(options['ready_by'])
+            if ready_by is None:
+                raise CommandError('--ready-by must be an ISO-8601 timestamp.')
+            if timezone.is_naive(ready_by):
+                ready_by = timezone.make_aware(ready_by)
+        else:
+            ready_by = now.replace(hour=7, minute=0, second=0, microsecond=0)
+            if ready_by <= now:
+                ready_by += timedelta(days=1)
+
+        window = timedelta(days=options['window_days'])
+        max_gap_hours = options['max_gap_hours'] or DEFAULT_MAX_GAP_HOURS
+        houses = plan_all(ready_by, window=window, max_gap_hours=max_gap_hours,
+                          using=options['database'])
+        self.stdout.write('Planned %d houses for %s.' % (houses, ready_by.isoformat()))
+
+        if options['prune']:
+            deleted, _ = RoomTemperatureReading.objects.using(options['database']).filter(
+                recorded__lt=timezone.now() - window).delete()
+            self.stdout.write('Pruned %d temperature readings.' % deleted)
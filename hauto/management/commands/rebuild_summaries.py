@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+from hauto.models import House, OwnerSummary, Room
+from hauto.summaries import rebuild_summaries
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the per-owner and per-house summary counters in one grouped pass.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS,
+                            help='Database to rebuild. Defaults to "default".')
+
+    def handle(self, *args, **options):
+        owners = rebuild_summaries(House, Room, OwnerSummary, using=options['database'])
+        self.stdout.write('Rebuilt summary counters for %d owners.' % owners)
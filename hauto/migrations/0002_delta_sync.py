@@ -0,0 +1,40 @@
+# Generated by Django 2.2.28 on 2026-10-19 19:14
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hauto', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tombstone',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model_name', models.CharField(choices=[('house', 'House'), ('room', 'Room')], max_length=10, verbose_name='Model')),
+                ('object_id', models.IntegerField(verbose_name='Object ID')),
+                ('deleted', models.DateTimeField(default=django.utils.timezone.now, editable=False)),
+            ],
+            options={
+                'ordering': ('deleted',),
+            },
+        ),
+        migrations.AlterField(
+            model_name='house',
+            name='modified',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='room',
+            name='modified',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='tombstone',
+            index=models.Index(fields=['model_name', 'deleted'], name='hauto_tombs_model_n_8c8ae1_idx'),
+        ),
+    ]
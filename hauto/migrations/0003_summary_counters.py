@@ -0,0 +1,48 @@
+# Generated by Django 2.2.28 on 2026-10-19 19:17
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+from hauto.summaries import rebuild_summaries
+
+
+def build_summaries(apps, schema_editor):
+    rebuild_summaries(
+        apps.get_model('hauto', 'House'), 
+        apps.get_model('hauto', 'Room'), 
+        apps.get_model('hauto', 'OwnerSummary'), 
+        using=schema_editor.connection.alias)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('hauto', '0002_delta_sync'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OwnerSummary',
+            fields=[
+                ('owner', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='summary', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('house_count', models.IntegerField(default=0, editable=False, verbose_name='Houses')),
+                ('room_count', models.IntegerField(default=0, editable=False, verbose_name='Rooms')),
+                ('lights_on_count', models.IntegerField(default=0, editable=False, verbose_name='Lights ON')),
+                ('furnaces_heating_count', models.IntegerField(default=0, editable=False, verbose_name='Furnaces running heat')),
+                ('furnaces_fan_count', models.IntegerField(default=0, editable=False, verbose_name='Furnaces running fan')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='house',
+            name='lights_on_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='Lights ON'),
+        ),
+        migrations.AddField(
+            model_name='house',
+            name='room_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='Rooms'),
+        ),
+        migrations.RunPython(build_summaries, migrations.RunPython.noop),
+    ]
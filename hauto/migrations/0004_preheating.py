@@ -0,0 +1,41 @@
+# Generated by Django 2.2.28 on 2026-10-19 19:21
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hauto', '0003_summary_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FurnacePlan',
+            fields=[
+                ('house', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='furnace_plan', serialize=False, to='hauto.House')),
+                ('furnace_status', models.CharField(choices=[('OFF', 'OFF'), ('FAN', 'Running Fan'), ('HEAT', 'Running Heat')], default='OFF', max_length=15, verbose_name='Furnace Status')),
+                ('setpoint', models.DecimalField(decimal_places=2, max_digits=5, null=True, verbose_name='Setpoint')),
+                ('start', models.DateTimeField(null=True, verbose_name='Start')),
+                ('ready_by', models.DateTimeField(verbose_name='Ready by')),
+                ('heat_rate', models.FloatField(verbose_name='Heat-up rate')),
+                ('cool_rate', models.FloatField(verbose_name='Cool-down rate')),
+                ('planned', models.DateTimeField(default=django.utils.timezone.now, editable=False)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RoomTemperatureReading',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('temperature', models.DecimalField(decimal_places=2, max_digits=5, verbose_name='Temperature')),
+                ('recorded', models.DateTimeField(db_index=True, default=django.utils.timezone.now, editable=False)),
+                ('house', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='readings', to='hauto.House')),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='readings', to='hauto.Room')),
+            ],
+            options={
+                'ordering': ('recorded',),
+            },
+        ),
+    ]
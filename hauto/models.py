@@ -5,10 +5,12 @@
 # Authentication 
 # Home Automation
 
+from collections import Counter, defaultdict
+
 from django.contrib.auth.models import User
-from django.db import models
+from django.db import connections, models, router, transaction
 from django.utils import timezone
-from django.db.models import Max, Min
+from django.db.models import F, Max, Min
 
 
 class TimeStampUpdate(models.Model):
@@ -21,13 +23,18 @@ class TimeStampUpdate(models.Model):
     @reference: https://stackoverflow.com/questions/1737017/django-auto-now-and-auto-now-add
     '''
     created = models.DateTimeField(editable=False, default=timezone.now)
-    modified = models.DateTimeField(editable=False, default=timezone.now)
+    # Indexed so clients can cheaply pull only what changed since their last sync.
+    modified = models.DateTimeField(editable=False, default=timezone.now, db_index=True)
 
     def save(self, *args, **kwargs):
         if not self.created:
             self.created = timezone.now()
 
         self.modified = timezone.now()
+        update_fields = kwargs.get('update_fields')
+        if update_fields:
+            # Partial saves must still stamp the row for delta sync.
+            kwargs['update_fields'] = set(update_fields) | {'modified'}
         return super().save(*args, **kwargs)
 
     class Meta:
@@ -35,7 +42,185 @@ class TimeStampUpdate(models.Model):
         
         
 
-class House(TimeStampUpdate):
+def apply_counter_changes(using, added=(), removed=()):
+    '''
+    Net out (model, pk, deltas) counter targets and bump each row once.
+    Rows are locked in one fixed order, by the model's `counter_lock_rank` 
+        then pk (houses before owner summaries, as in House.save), so 
+        concurrent saves can not deadlock on each other's counters.
+    '''
+    changes = defaultdict(Counter)
+    for model, pk, deltas in removed:
+        changes[(model, pk)].subtract(deltas)
+    for model, pk, deltas in added:
+        changes[(model, pk)].update(deltas)
+    targets = sorted((key for key in changes if key[1] is not None), 
+                     key=lambda key: (key[0].counter_lock_rank, key[1]))
+    for model, pk in targets:
+        model.bump_counters(pk, using, changes[(model, pk)])
+        
+        
+        
+class SummaryCounted(models.Model):
+    '''
+    Keeps the denormalized counters (House.room_count, OwnerSummary.*) in step
+        with the rows they count, in the same transaction as the save.
+    The row's stored state is re-read and locked (select_for_update) inside 
+        that transaction, so an update only moves the counters by the 
+        difference from what is actually stored (eg. a light going ON -> OFF, 
+        a room moving to another house), however stale the instance is.
+    Deletes (cascades included) are handled by pre/post_delete receivers; 
+        bulk paths must call apply_counter_changes themselves.
+    '''
+    # Attribute names the counters depend on.
+    counted_fields = ()
+    
+    def current_counted_state(self):
+        return {f: getattr(self, f) for f in self.counted_fields}
+    
+    def stored_counted_state(self, using):
+        '''
+        The state the counters currently reflect, locked until the end of the
+        transaction, or None if the row is not (or no longer) stored.
+        '''
+        if self._state.adding or self.pk is None:
+            return None
+        return type(self)._base_manager.using(using).select_for_update().filter(
+            pk=self.pk).values(*self.counted_fields).first()
+    
+    def counter_targets(self, state):
+        '''
+        (model, pk, deltas) for every counter row this state contributes to.
+        '''
+        raise NotImplementedError
+    
+    def save(self, *args, **kwargs):
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using):
+            old = self.stored_counted_state(using)
+            result = super().save(*args, **kwargs)
+            new = self.current_counted_state()
+            apply_counter_changes(
+                using, 
+                added=self.counter_targets(new), 
+                removed=self.counter_targets(old) if old else ())
+        return result
+    
+    class Meta:
+        abstract = True
+        
+        
+
+class OwnerSummary(models.Model):
+    '''
+    Per-owner counters, so account pages do not COUNT over House/Room on 
+        every load. Rebuild with `manage.py rebuild_summaries` if they drift.
+    '''
+    owner = models.OneToOneField(User, primary_key=True, related_name='summary', 
+                                 on_delete=models.CASCADE)
+    house_count = models.IntegerField("Houses", default=0, editable=False)
+    room_count = models.IntegerField("Rooms", default=0, editable=False)
+    lights_on_count = models.IntegerField("Lights ON", default=0, editable=False)
+    furnaces_heating_count = models.IntegerField("Furnaces running heat", default=0, editable=False)
+    furnaces_fan_count = models.IntegerField("Furnaces running fan", default=0, editable=False)
+    
+    counter_lock_rank = 1
+    
+    @classmethod
+    def bump_counters(cls, owner_id, using, deltas):
+        deltas = {f: d for f, d in deltas.items() if d}
+        if owner_id is None or not deltas:
+            return
+        summaries = cls._base_manager.using(using)
+        changes = {f: F(f) + d for f, d in deltas.items()}
+        # First house/room of this owner. Never create on a pure decrement:
+        # the owner may be the one being deleted.
+        if not summaries.filter(pk=owner_id).update(**changes) and any(
+                d > 0 for d in deltas.values()):
+            # get_or_create inserts in a savepoint and falls back to a get when 
+            # a concurrent save created the row first; then count as usual.
+            summaries.get_or_create(owner_id=owner_id)
+            summaries.filter(pk=owner_id).update(**changes)
+    
+    def __str__(self):
+        return "%s summary" % self.owner_id
+        
+        
+
+class HouseManager(models.Manager):
+    
+    def onboard(self, houses):
+        '''
+        Create many houses together with their rooms in one transaction.
+        `houses` is a list of House field dicts, each with an optional 
+            'rooms' list of Room field dicts. Rooms inherit the house owner.
+        Rooms go in with bulk_create and the initial furnace temperature is 
+            worked out from the payload up front, so there is no per-room save 
+            and no per-house room aggregation.
+        '''
+        using = self._db or router.db_for_write(self.model)
+        now = timezone.now()
+        house_objs, house_rooms = [], []
+        for data in houses:
+            data = dict(data)
+            rooms = data.pop('rooms', None) or []
+            house = self.model(created=now, modified=now, **data)
+            house.room_count = len(rooms)
+            house.lights_on_count = sum(1 for room in rooms if room.get('light_status') == Room.ON)
+            temperatures = [room['room_temperature'] for room in rooms]
+            if temperatures:
+                house.furnace_temperature = House.energy_saver_temperature(
+                    house.furnace_status, max(temperatures), min(temperatures), 
+                    house.furnace_temperature)
+            house_objs.append(house)
+            house_rooms.append(rooms)
+        
+        with transaction.atomic(using=using):
+            if connections[using].features.can_return_ids_from_bulk_insert:
+                self.using(using).bulk_create(house_objs)
+            else:
+                # Backend cannot hand back the new ids (eg. SQLite); plain inserts.
+                for house in house_objs:
+                    house.save_base(using=using, force_insert=True)
+            
+            room_objs = [
+                Room(created=now, modified=now, house=house, owner=house.owner, **room)
+                for house, rooms in zip(house_objs, house_rooms) for room in rooms
+            ]
+            Room.objects.using(using).bulk_create(room_objs)
+            
+            # House counters were filled in above; only the owners are left.
+            targets = [target for house in house_objs 
+                       for target in house.counter_targets(house.current_counted_state())]
+            targets += [target for room in room_objs 
+                        for target in room.counter_targets(room.current_counted_state())
+                        if target[0] is not House]
+            apply_counter_changes(using, added=targets)
+            
+            RoomTemperatureReading.objects.using(using).bulk_create(
+                RoomTemperatureReading(room_id=room_id, house_id=house_id, 
+                                       temperature=temperature, recorded=now)
+                for room_id, house_id, temperature in self._new_room_rows(house_objs, room_objs, using))
+        
+        return house_objs
+    
+    def _new_room_rows(self, house_objs, room_objs, using):
+        '''
+        (id, house_id, room_temperature) of freshly bulk created rooms.
+        '''
+        if not room_objs or room_objs[0].pk is not None:
+            return [(room.pk, room.house_id, room.room_temperature) for room in room_objs]
+        # No ids back from the bulk insert; read them back in IN-list sized chunks.
+        house_ids = [house.pk for house in house_objs]
+        rows = []
+        for i in range(0, len(house_ids), 500):
+            rows += Room.objects.using(using).filter(house_id__in=house_ids[i:i + 500]).values_list(
+                'id', 'house_id', 'room_temperature')
+        return rows
+        
+        
+
+class House(SummaryCounted, TimeStampUpdate):
     '''
     @Note : Houses can be identified by address(Street address, Unit, City, 
                 State/Province, Zip/Post Code, Country)
@@ -105,24 +290,67 @@ class House(TimeStampUpdate):
         blank=True,
     )
     owner = models.ForeignKey(User, related_name='houses', on_delete=models.CASCADE)    
+    # Denormalized, maintained by Room saves/deletes (see SummaryCounted).
+    room_count = models.IntegerField("Rooms", default=0, editable=False)
+    lights_on_count = models.IntegerField("Lights ON", default=0, editable=False)
+    
+    COUNTER_FIELDS = ('room_count', 'lights_on_count')
+    counted_fields = ('owner_id', 'furnace_status')
+    
+    objects = HouseManager()
+    
+    counter_lock_rank = 0
+    
+    @classmethod
+    def bump_counters(cls, house_id, using, deltas):
+        deltas = {f: d for f, d in deltas.items() if d}
+        if house_id is None or not deltas:
+            return
+        # Counters are part of the synced house representation.
+        cls._base_manager.using(using).filter(pk=house_id).update(
+            modified=timezone.now(), **{f: F(f) + d for f, d in deltas.items()})
+        
+    def counter_targets(self, state):
+        return [(OwnerSummary, state['owner_id'], {
+            'house_count': 1,
+            'furnaces_heating_count': int(state['furnace_status'] == House.HEAT),
+            'furnaces_fan_count': int(state['furnace_status'] == House.FAN),
+        })]
+    
+    @staticmethod
+    def energy_saver_temperature(furnace_status, max_temp, min_temp, default):
+        '''
+        HEAT runs the furnace at Max(room temp), FAN at Min(room temp).
+        '''
+        if furnace_status == House.HEAT and max_temp:
+            return max_temp
+        elif furnace_status == House.FAN and min_temp:
+            return min_temp
+        return default
    
     def save(self, *args, **kwargs):
         ''' 
         Energy saver mode :: on update of furnace status.
         '''
         if self.id:
+            # Always aggregate on the database being written (the primary), 
+            # never a possibly lagging read replica.
+            rooms = Room.objects.using(kwargs.get('using') or router.db_for_write(House, instance=self))
             # Get the Max(room temp) for all rooms in this house instance.
-            rqset_max = Room.objects.filter(house_id=self.id).aggregate(Max('room_temperature'))
+            rqset_max = rooms.filter(house_id=self.id).aggregate(Max('room_temperature'))
             self._max_temp = rqset_max.get('room_temperature__max')
             # Get the Min(room temp) for all rooms in this house instance.
-            rqset_min = Room.objects.filter(house_id=self.id).aggregate(Min('room_temperature'))
+            rqset_min = rooms.filter(house_id=self.id).aggregate(Min('room_temperature'))
             self._min_temp = rqset_min.get('room_temperature__min')
             
-            if self.furnace_status == 'HEAT' and self._max_temp:
-                self.furnace_temperature = self._max_temp
-            elif self.furnace_status == 'FAN' and self._min_temp:
-                self.furnace_temperature = self._min_temp
+            self.furnace_temperature = self.energy_saver_temperature(
+                self.furnace_status, self._max_temp, self._min_temp, self.furnace_temperature)
         
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            # Never write back the (possibly stale) in-memory room counters.
+            kwargs['update_fields'] = [
+                f.name for f in self._meta.concrete_fields 
+                if not f.primary_key and f.name not in self.COUNTER_FIELDS]
         return super().save(*args, **kwargs)
     
     def __str__(self):
@@ -133,7 +361,7 @@ class House(TimeStampUpdate):
         
         
               
-class Room(TimeStampUpdate):
+class Room(SummaryCounted, TimeStampUpdate):
     """ 
     Assumption: Temperature scale is in degree celcius
     """
@@ -159,11 +387,95 @@ class Room(TimeStampUpdate):
     )
     owner = models.ForeignKey(User, related_name='rooms', on_delete=models.CASCADE) 
     
+    counted_fields = ('owner_id', 'house_id', 'light_status')
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Last temperature on record, see hauto.signals.record_temperature.
+        instance._recorded_temperature = instance.__dict__.get('room_temperature')
+        return instance
+    
+    def counter_targets(self, state):
+        deltas = {'room_count': 1, 'lights_on_count': int(state['light_status'] == Room.ON)}
+        return [
+            (House, state['house_id'], deltas),
+            (OwnerSummary, state['owner_id'], deltas),
+        ]
+    
     class Meta:
         unique_together = ('room_label', 'house',)
         ordering = ('id',)
         
     def __str__(self):
         return "%s" % self.room_label
+
+
+class Tombstone(models.Model):
+    '''
+    Record of a deleted House or Room.
+    Delta sync clients cannot see a deletion through the `modified` timestamp
+        (the row is gone), so every delete leaves a tombstone behind. 
+        Written from a post_delete signal so cascade deletes are covered too.
+    '''
+    HOUSE = 'house'
+    ROOM = 'room'
+    MODEL_CHOICES = (
+        (HOUSE, 'House'),
+        (ROOM, 'Room'),
+    )
+    
+    model_name = models.CharField("Model", max_length=10, choices=MODEL_CHOICES)
+    object_id = models.IntegerField("Object ID")
+    deleted = models.DateTimeField(editable=False, default=timezone.now)
+    
+    class Meta:
+        indexes = [models.Index(fields=['model_name', 'deleted'])]
+        ordering = ('deleted',)
+        
+    def __str__(self):
+        return "%s #%s" % (self.model_name, self.object_id)
+        
+        
+
+class RoomTemperatureReading(models.Model):
+    '''
+    A recorded room temperature change (written whenever a Room is saved with 
+        a new temperature). The pre-heating planner (hauto.preheat) learns 
+        each house's heat-up / cool-down rates from these.
+    The house is kept as it was at the time, so rooms moved between houses 
+        do not mix up their history.
+    '''
+    room = models.ForeignKey(Room, related_name='readings', on_delete=models.CASCADE)
+    house = models.ForeignKey(House, related_name='readings', on_delete=models.CASCADE)
+    temperature = models.DecimalField("Temperature", max_digits=5, decimal_places=2)
+    recorded = models.DateTimeField(editable=False, default=timezone.now, db_index=True)
+    
+    class Meta:
+        ordering = ('recorded',)
         
-    
\ No newline at end of file
+    def __str__(self):
+        return "%s: %s" % (self.room_id, self.temperature)
+    
+    
+
+class FurnacePlan(models.Model):
+    '''
+    Latest pre-heating plan for a house, written by `manage.py plan_preheating`.
+    Switch the furnace to `furnace_status` at `start` with `setpoint` and the 
+        rooms are at temperature by `ready_by`. OFF means nothing to do.
+    '''
+    house = models.OneToOneField(House, primary_key=True, related_name='furnace_plan', 
+                                 on_delete=models.CASCADE)
+    furnace_status = models.CharField("Furnace Status", max_length=15, 
+                                      choices=House.FURNACE_STATE_CHOICES, default=House.OFF)
+    setpoint = models.DecimalField("Setpoint", max_digits=5, decimal_places=2, null=True)
+    start = models.DateTimeField("Start", null=True)
+    ready_by = models.DateTimeField("Ready by")
+    # Learned rates, degrees celcius per hour.
+    heat_rate = models.FloatField("Heat-up rate")
+    cool_rate = models.FloatField("Cool-down rate")
+    planned = models.DateTimeField(editable=False, default=timezone.now)
+    
+    def __str__(self):
+        return "%s %s @ %s" % (self.house_id, self.furnace_status, self.start)
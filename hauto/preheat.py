@@ -0,0 +1,172 @@
+'''
+Predictive furnace pre-heating.
+
+The energy saver in House.save only reacts when someone changes the furnace
+status. The planner looks ahead instead: it learns how fast every house heats
+up and cools down from its recorded room temperature changes
+(RoomTemperatureReading) and works out when each furnace has to start, and at
+what setpoint, so the rooms are at temperature by a given time.
+
+Setpoints follow the energy saver rule: heat to Max(room temp), or run the fan
+down to Min(room temp), starting from the current furnace temperature.
+
+All the maths runs on NumPy arrays covering every house at once; only
+loading the inputs and writing the FurnacePlan rows touch the database.
+NumPy is only imported here, so API workers never pay for it.
+'''
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import numpy as np
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from hauto.models import FurnacePlan, House, Room, RoomTemperatureReading
+
+
+# Used until a house has history of its own, degrees celcius per hour.
+DEFAULT_HEAT_RATE = 1.5
+DEFAULT_COOL_RATE = 1.0
+
+# Readings further apart than this are not one heating/cooling run: the furnace
+# was most likely idle in between (room temperatures are recorded on change).
+DEFAULT_MAX_GAP_HOURS = 6.0
+
+# Status codes used in the arrays.
+OFF, HEAT, FAN = 0, 1, 2
+STATUSES = {OFF: House.OFF, HEAT: House.HEAT, FAN: House.FAN}
+
+
+def learn_rates(house_index, room_ids, seconds, temperatures, houses,
+                default_heat=DEFAULT_HEAT_RATE, default_cool=DEFAULT_COOL_RATE,
+                max_gap_hours=DEFAULT_MAX_GAP_HOURS):
+    '''
+    Heat-up and cool-down rates (degrees/hour) per house.
+
+    Inputs are parallel arrays of readings sorted by (room, time);
+        `house_index` maps each reading to 0..houses-1.
+    A rate is total temperature change over total time, taken over the
+        consecutive readings of the same room in the same house that went up
+        (heat) or down (cool), at most `max_gap_hours` apart. Houses with no
+        such pair get the defaults.
+    '''
+    house_index = np.asarray(house_index)
+    room_ids = np.asarray(room_ids)
+    hours = np.diff(np.asarray(seconds, dtype=float)) / 3600.0
+    change = np.diff(np.asarray(temperatures, dtype=float))
+
+    valid = ((room_ids[1:] == room_ids[:-1])
+             & (house_index[1:] == house_index[:-1])
+             & (hours > 0)
+             & (hours <= max_gap_hours))
+    house = house_index[1:]
+
+    def rate(mask, default):
+        degrees = np.bincount(house[mask], weights=np.abs(change[mask]), minlength=houses)
+        elapsed = np.bincount(house[mask], weights=hours[mask], minlength=houses)
+        learned = elapsed > 0
+        return np.where(learned, degrees / np.where(learned, elapsed, 1.0), default)
+
+    return (rate(valid & (change > 0), default_heat),
+            rate(valid & (change < 0), default_cool))
+
+
+def plan(current, max_temps, min_temps, heat_rates, cool_rates, ready_by, now):
+    '''
+    Furnace status, setpoint and start time (same units as `ready_by`/`now`,
+    seconds) per house.
+
+    Heat when some room needs more than the furnace is at now, else run the
+        fan when some room needs less, else stay OFF. Houses without rooms
+        (NaN max/min) stay OFF. Start is when heating/cooling at the learned
+        rate reaches the setpoint exactly at `ready_by`, never earlier than
+        `now` (already late: start right away). Start is NaN for OFF.
+    '''
+    current = np.asarray(current, dtype=float)
+    max_temps = np.asarray(max_temps, dtype=float)
+    min_temps = np.asarray(min_temps, dtype=float)
+
+    heat = max_temps > current
+    fan = ~heat & (min_temps < current)
+    status = np.where(heat, HEAT, np.where(fan, FAN, OFF))
+    setpoint = np.where(heat, max_temps, np.where(fan, min_temps, current))
+
+    hours = np.where(heat, (setpoint - current) / heat_rates,
+                     np.where(fan, (current - setpoint) / cool_rates, 0.0))
+    start = np.maximum(ready_by - hours * 3600.0, now)
+    start = np.where(status == OFF, np.nan, start)
+    return status, setpoint, start
+
+
+def plan_all(ready_by, window=timedelta(days=14), max_gap_hours=DEFAULT_MAX_GAP_HOURS,
+             using=DEFAULT_DB_ALIAS):
+    '''
+    Plan every house for `ready_by` and replace the stored FurnacePlans.
+    Learns from the readings of the last `window` (see learn_rates for
+    `max_gap_hours`). Returns the house count.
+    '''
+    now = timezone.now()
+
+    houses = list(House.objects.using(using).order_by('id').values_list('id', 'furnace_temperature'))
+    count = len(houses)
+    if not count:
+        return 0
+    house_ids = np.array([row[0] for row in houses], dtype=np.int64)
+    current = np.array([row[1] for row in houses], dtype=float)
+
+    def index_of(ids):
+        # Position of each house id in house_ids (sorted), -1 if unknown.
+        ids = np.asarray(ids, dtype=np.int64)
+        index = np.searchsorted(house_ids, ids)
+        index[index == count] = 0
+        return np.where(house_ids[index] == ids, index, -1)
+
+    max_temps = np.full(count, np.nan)
+    min_temps = np.full(count, np.nan)
+    bounds = list(Room.objects.using(using).filter(house__isnull=False).order_by().values(
+        'house').annotate(max_temp=Max('room_temperature'), min_temp=Min('room_temperature')
+        ).values_list('house', 'max_temp', 'min_temp'))
+    if bounds:
+        index = index_of([row[0] for row in bounds])
+        known = index >= 0
+        max_temps[index[known]] = np.array([row[1] for row in bounds], dtype=float)[known]
+        min_temps[index[known]] = np.array([row[2] for row in bounds], dtype=float)[known]
+
+    readings = list(RoomTemperatureReading.objects.using(using).filter(
+        recorded__gte=now - window).order_by('room_id', 'recorded').values_list(
+        'room_id', 'house_id', 'recorded', 'temperature'))
+    if readings:
+        index = index_of([row[1] for row in readings])
+        known = index >= 0
+        heat_rates, cool_rates = learn_rates(
+            index[known],
+            np.array([row[0] for row in readings], dtype=np.int64)[known],
+            np.array([row[2].timestamp() for row in readings])[known],
+            np.array([row[3] for row in readings], dtype=float)[known],
+            count, max_gap_hours=max_gap_hours)
+    else:
+        heat_rates = np.full(count, DEFAULT_HEAT_RATE)
+        cool_rates = np.full(count, DEFAULT_COOL_RATE)
+
+    status, setpoint, start = plan(
+        current, max_temps, min_temps, heat_rates, cool_rates,
+        ready_by.timestamp(), now.timestamp())
+
+    plans = [
+        FurnacePlan(
+            house_id=int(house_id),
+            furnace_status=STATUSES[int(code)],
+            setpoint=None if code == OFF else Decimal('%.2f' % point),
+            start=None if code == OFF else datetime.fromtimestamp(when, timezone.utc),
+            ready_by=ready_by,
+            heat_rate=float(heat_rate),
+            cool_rate=float(cool_rate),
+            planned=now)
+        for house_id, code, point, when, heat_rate, cool_rate
+        in zip(house_ids, status, setpoint, start, heat_rates, cool_rates)
+    ]
+    with transaction.atomic(using=using):
+        FurnacePlan.objects.using(using).all().delete()
+        FurnacePlan.objects.using(using).bulk_create(plans)
+    return count
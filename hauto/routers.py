@@ -0,0 +1,62 @@
+'''
+Primary / read replica database routing.
+
+Writes always go to the primary (`default`). Reads go to the primary too,
+unless a view switched on replica reads for the current request (see
+hauto.views.ReplicaReadMixin): then they go to one of the aliases listed in
+settings.DATABASE_REPLICAS, picked once per request so all of its queries see
+the same replica (and requests are spread over them).
+
+Read-your-writes: after a successful write a user is pinned to the primary for
+settings.REPLICA_PIN_SECONDS, so they do not read back a stale replica. Pins
+live in the Django cache; use a shared cache backend when running several
+worker processes.
+'''
+import random
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+
+_local = threading.local()
+
+
+def set_replica_reads(enabled):
+    '''
+    Turn replica reads on or off for the current thread, picking the replica
+    its reads go to until they are turned off.
+    '''
+    replicas = getattr(settings, 'DATABASE_REPLICAS', ())
+    _local.replica_alias = random.choice(replicas) if enabled and replicas else None
+
+
+def _pin_key(user):
+    return 'hauto:primary-pin:%s' % user.pk
+
+
+def pin_to_primary(user):
+    if user.is_authenticated:
+        cache.set(_pin_key(user), True, getattr(settings, 'REPLICA_PIN_SECONDS', 5))
+
+
+def is_pinned(user):
+    return user.is_authenticated and bool(cache.get(_pin_key(user)))
+
+
+class PrimaryReplicaRouter(object):
+    
+    def db_for_read(self, model, **hints):
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            # Follow relations on the database the instance came from.
+            return instance._state.db
+        return getattr(_local, 'replica_alias', None) or DEFAULT_DB_ALIAS
+    
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+    
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary.
+        return True
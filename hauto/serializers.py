@@ -1,5 +1,7 @@
+from django.utils import timezone
 from rest_framework import serializers
-from hauto.models import House, Room
+from hauto.models import House, OwnerSummary, Room
+from hauto.summaries import recount_house_rooms
 from django.contrib.auth.models import User
 
 
@@ -11,7 +13,36 @@ class HouseSerializer(serializers.HyperlinkedModelSerializer):
     class Meta:
         model = House
         fields = ('url', 'id', 'owner', 'street_address', 'unit', 'city', 'state_province', 
-                  'zip_code', 'country', 'furnace_temperature', 'furnace_status', 'rooms')
+                  'zip_code', 'country', 'furnace_temperature', 'furnace_status', 'rooms',
+                  'room_count', 'lights_on_count')
+        
+    def create(self, validated_data):
+        rooms = validated_data.get('rooms')
+        former = {room.house_id for room in rooms or () if room.house_id}
+        house = super().create(validated_data)
+        if rooms is not None:
+            self._rooms_moved(house, former, {room.pk for room in rooms})
+        return house
+        
+    def update(self, instance, validated_data):
+        rooms = validated_data.get('rooms')
+        former = {room.house_id for room in rooms or () if room.house_id}
+        if rooms is not None:
+            # Rooms leaving this house move too (to no house).
+            attached = set(instance.rooms.values_list('pk', flat=True))
+        house = super().update(instance, validated_data)
+        if rooms is not None:
+            self._rooms_moved(house, former, attached ^ {room.pk for room in rooms})
+        return house
+    
+    def _rooms_moved(self, house, former, moved):
+        # Attaching/detaching rooms goes through a queryset update (no 
+        # Room.save): bump `modified` so room delta sync sees the move, and
+        # recompute the room counters of every house involved.
+        if moved:
+            Room.objects.filter(pk__in=moved).update(modified=timezone.now())
+        recount_house_rooms(House.objects.filter(pk__in={house.pk} | former), Room)
+        house.refresh_from_db(fields=House.COUNTER_FIELDS)
         
 
 class RoomSerializer(serializers.HyperlinkedModelSerializer):
@@ -23,11 +54,62 @@ class RoomSerializer(serializers.HyperlinkedModelSerializer):
         fields = ('url', 'id', 'owner', 'house', 'room_label', 'room_temperature', 'light_status')
         
         
+class BulkRoomSerializer(serializers.ModelSerializer):
+    
+    class Meta:
+        model = Room
+        fields = ('room_label', 'room_temperature', 'light_status')
+        
+        
+class BulkHouseListSerializer(serializers.ListSerializer):
+    
+    def create(self, validated_data):
+        return House.objects.onboard(validated_data)
+    
+    
+class BulkHouseSerializer(serializers.ModelSerializer):
+    '''
+    A house with its rooms nested, for onboarding many houses in one request.
+    '''
+    rooms = BulkRoomSerializer(many=True, required=False)
+    
+    class Meta:
+        model = House
+        list_serializer_class = BulkHouseListSerializer
+        fields = ('id', 'street_address', 'unit', 'city', 'state_province', 
+                  'zip_code', 'country', 'furnace_temperature', 'furnace_status', 'rooms')
+        
+    def validate_rooms(self, rooms):
+        # unique_together('room_label', 'house'): the house is new, so only
+        # the payload itself can clash.
+        labels = [room['room_label'] for room in rooms if room.get('room_label') is not None]
+        if len(labels) != len(set(labels)):
+            raise serializers.ValidationError('Room labels must be unique within a house.')
+        return rooms
+        
+        
+class OwnerSummarySerializer(serializers.ModelSerializer):
+    
+    class Meta:
+        model = OwnerSummary
+        fields = ('house_count', 'room_count', 'lights_on_count', 
+                  'furnaces_heating_count', 'furnaces_fan_count')
+        
+        
 class UserSerializer(serializers.HyperlinkedModelSerializer):
     houses = serializers.HyperlinkedRelatedField(
         many=True, view_name='house-detail', read_only=True)
+    summary = serializers.SerializerMethodField()
 
     class Meta:
         model = User
-        fields = ('url', 'id', 'username', 'houses')
-        ordering = ('id',)
\ No newline at end of file
+        fields = ('url', 'id', 'username', 'houses', 'summary')
+        ordering = ('id',)
+        
+    def get_summary(self, user):
+        try:
+            summary = user.summary
+        except OwnerSummary.DoesNotExist:
+            # Owns nothing yet.
+            summary = OwnerSummary(owner=user)
+        return OwnerSummarySerializer(summary).data
@@ -0,0 +1,55 @@
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from hauto.models import (
+    House, Room, RoomTemperatureReading, Tombstone, apply_counter_changes)
+
+
+@receiver(post_delete, sender=House)
+@receiver(post_delete, sender=Room)
+def record_tombstone(sender, instance, using, **kwargs):
+    '''
+    Leave a tombstone for delta sync clients. post_delete also fires for
+    rows removed by a cascade (eg. the rooms of a deleted house).
+    '''
+    Tombstone.objects.using(using).create(
+        model_name=sender._meta.model_name,
+        object_id=instance.pk)
+
+
+@receiver(pre_delete, sender=House)
+@receiver(pre_delete, sender=Room)
+def lock_summary_counters(sender, instance, using, **kwargs):
+    '''
+    Runs inside the delete transaction: lock the row and note what it 
+    actually contributes to the counters (the instance may be stale).
+    '''
+    instance._deleted_counted_state = instance.stored_counted_state(using)
+
+
+@receiver(post_delete, sender=House)
+@receiver(post_delete, sender=Room)
+def release_summary_counters(sender, instance, using, **kwargs):
+    '''
+    Runs inside the delete transaction, once per row, cascades included.
+    A row someone else already deleted has nothing left to release.
+    '''
+    state = getattr(instance, '_deleted_counted_state', None)
+    if state:
+        apply_counter_changes(using, removed=instance.counter_targets(state))
+
+
+@receiver(post_save, sender=Room)
+def record_temperature(sender, instance, created, raw, using, **kwargs):
+    '''
+    Keep the temperature history the pre-heating planner learns from.
+    Runs inside Room.save's transaction (see SummaryCounted).
+    '''
+    if raw or instance.house_id is None:
+        return
+    if created or getattr(instance, '_recorded_temperature', None) != instance.room_temperature:
+        RoomTemperatureReading.objects.using(using).create(
+            room=instance, 
+            house_id=instance.house_id, 
+            temperature=instance.room_temperature,
+            recorded=instance.modified)
+        instance._recorded_temperature = instance.room_temperature
@@ -0,0 +1,62 @@
+'''
+Grouped (re)computation of the denormalized summary counters.
+Functions take the model classes so data migrations can pass historical models.
+'''
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+
+def count_of(rows, **filters):
+    '''
+    COUNT of the correlated `rows` subquery (values() of the outer key), 0 if none.
+    '''
+    return Coalesce(Subquery(
+        rows.filter(**filters).annotate(n=Count('id')).values('n'), 
+        output_field=IntegerField()), 0)
+
+
+def recount_house_rooms(houses, Room):
+    '''
+    Recompute room_count/lights_on_count for the `houses` queryset in a single 
+    UPDATE (correlated subqueries, no per-house round trip). Only houses whose
+    counts actually change are written, and their `modified` is bumped since 
+    the counters are part of the synced house representation.
+    '''
+    rooms = Room._base_manager.filter(house=OuterRef('pk')).order_by().values('house')
+    room_count = count_of(rooms)
+    lights_on_count = count_of(rooms, light_status='ON')
+    return houses.exclude(room_count=room_count, lights_on_count=lights_on_count).update(
+        room_count=room_count,
+        lights_on_count=lights_on_count,
+        modified=timezone.now())
+
+
+def rebuild_summaries(House, Room, OwnerSummary, using=DEFAULT_DB_ALIAS):
+    '''
+    Rebuild every counter from scratch, in place: one UPDATE for the houses and
+    one for the owner summaries (correlated subqueries).
+    Summary rows are never deleted and re-inserted, since concurrent counter 
+        bumps update them in place; only owners without a row get one.
+    '''
+    with transaction.atomic(using=using):
+        recount_house_rooms(House._base_manager.using(using), Room)
+        
+        summaries = OwnerSummary._base_manager.using(using)
+        owners = set()
+        for model in (House, Room):
+            owners.update(model._base_manager.using(using).order_by().values_list(
+                'owner', flat=True).distinct())
+        owners.difference_update(summaries.values_list('owner', flat=True))
+        for owner_id in owners:
+            summaries.get_or_create(owner_id=owner_id)
+        
+        houses = House._base_manager.filter(owner=OuterRef('pk')).order_by().values('owner')
+        rooms = Room._base_manager.filter(owner=OuterRef('pk')).order_by().values('owner')
+        return summaries.update(
+            house_count=count_of(houses),
+            furnaces_heating_count=count_of(houses, furnace_status='HEAT'),
+            furnaces_fan_count=count_of(houses, furnace_status='FAN'),
+            room_count=count_of(rooms),
+            lights_on_count=count_of(rooms, light_status='ON'))
@@ -1,11 +1,26 @@
 from django.test import TestCase
 from rest_framework.test import APIRequestFactory
 from rest_framework.test import APIClient
+from unittest import mock
+
+from rest_framework import viewsets
+from hauto import routers
+from hauto.serializers import HouseSerializer
+from hauto.views import DeltaSyncMixin, HouseViewSet, ReplicaReadMixin
 from hauto.models import House, Room
 from django.contrib.auth.models import User
 import json
 
+import os
+import subprocess
+import sys
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.test import override_settings
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework import status
 from rest_framework.test import APITestCase
 
@@ -87,14 +102,424 @@ class DetailURLRequestTests(APITestCase):
         self.assertEqual(user_response.status_code, status.HTTP_200_OK)
         self.assertEqual(house_response.status_code, status.HTTP_200_OK)
         self.assertEqual(room_response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(user_response.data), 4)
+        self.assertEqual(len(user_response.data), 5)
         self.assertEqual(len(house_response.data), 7)
         self.assertEqual(len(room_response.data), 7)
         
         
         
+class DeltaSyncTests(APITestCase):
+    
+    def setUp(self):
+        self.owner = create_user(
+                    username='sam', 
+                    password='nimda123', email='sam@gmail.com')
+        self.house = create_house(
+                    street_address='9 London st', 
+                    city='St. Catharines',
+                    country='Canada',
+                    furnace_temperature=34.0, 
+                    owner=self.owner)
+        self.room1 = create_room(
+                    room_label='room1', 
+                    room_temperature=27.0, 
+                    house=self.house, 
+                    owner=self.owner)
+        self.room2 = create_room(
+                    room_label='room2', 
+                    room_temperature=25.0, 
+                    house=self.house, 
+                    owner=self.owner)
+        # Older than the sync token margin.
+        an_hour_ago = timezone.now() - timedelta(hours=1)
+        House.objects.update(modified=an_hour_ago)
+        Room.objects.update(modified=an_hour_ago)
+    
+    def test_sync_returns_only_changes_since_token(self):
+        '''
+        A first sync returns everything; a second one only what changed since
+        the returned token.
+        '''
+        response = self.client.get(reverse('room-sync'), format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['changed']), 2)
+        self.assertEqual(response.data['deleted'], [])
+        
+        self.room2.light_status = 'ON'
+        self.room2.save()
+        
+        response = self.client.get(reverse('room-sync'), 
+                                   {'since': response.data['sync_token']}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([room['id'] for room in response.data['changed']], [self.room2.id])
+        
+    def test_sync_reports_deleted_rooms_and_houses(self):
+        '''
+        Deleting a house cascades to its rooms; both leave tombstones behind.
+        '''
+        token = self.client.get(reverse('house-sync'), format='json').data['sync_token']
+        house_id = self.house.id
+        self.house.delete()
+        
+        house_response = self.client.get(reverse('house-sync'), {'since': token}, format='json')
+        room_response = self.client.get(reverse('room-sync'), {'since': token}, format='json')
+        self.assertEqual(house_response.data['changed'], [])
+        self.assertEqual(house_response.data['deleted'], [house_id])
+        self.assertEqual(sorted(room_response.data['deleted']), [self.room1.id, self.room2.id])
+        
+    def test_list_modified_since_filter(self):
+        before = self.client.get(reverse('room-sync'), format='json').data['sync_token']
+        self.room1.room_temperature = 28.0
+        self.room1.save()
+        
+        response = self.client.get(reverse('room-list'), {'modified_since': before}, format='json')
+        self.assertEqual(response.data['count'], 1)
+        
+        response = self.client.get(reverse('room-list'), {'modified_since': 'yesterday'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        
+        # Only the list is filtered.
+        response = self.client.get(reverse('room-detail', args=(self.room2.id,)), 
+                                   {'modified_since': before}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        
+    def test_sync_token_covers_writes_committed_late(self):
+        '''
+        A row stamped just before a sync but committed after it is still 
+        returned by the next sync.
+        '''
+        token = self.client.get(reverse('room-sync'), format='json').data['sync_token']
+        Room.objects.filter(pk=self.room1.pk).update(modified=timezone.now() - timedelta(seconds=1))
+        
+        response = self.client.get(reverse('room-sync'), {'since': token}, format='json')
+        self.assertEqual([room['id'] for room in response.data['changed']], [self.room1.id])
+
+    def test_sync_reports_partial_saves(self):
+        '''
+        Saving with update_fields still stamps the row as modified.
+        '''
+        token = self.client.get(reverse('house-sync'), format='json').data['sync_token']
+        self.house.furnace_status = 'FAN'
+        self.house.save(update_fields=['furnace_status'])
+
+        response = self.client.get(reverse('house-sync'), {'since': token}, format='json')
+        self.assertEqual([house['id'] for house in response.data['changed']], [self.house.id])
+
+    @override_settings(SYNC_PAGE_SIZE=2)
+    def test_sync_pages_until_caught_up(self):
+        '''
+        Records come in (modified, id) order, a page at a time, with a
+        continuation token until the client has caught up.
+        '''
+        room3 = create_room(room_label='room3', room_temperature=20.0,
+                            house=self.house, owner=self.owner)
+        room4 = create_room(room_label='room4', room_temperature=20.0,
+                            house=self.house, owner=self.owner)
+        Room.objects.filter(pk__in=(room3.pk, room4.pk)).update(
+            modified=timezone.now() - timedelta(minutes=30))
+
+        first = self.client.get(reverse('room-sync'), format='json').data
+        self.assertTrue(first['more'])
+        self.assertEqual([room['id'] for room in first['changed']], [self.room1.id, self.room2.id])
+
+        second = self.client.get(reverse('room-sync'), {'since': first['sync_token']},
+                                 format='json').data
+        self.assertEqual([room['id'] for room in second['changed']], [room3.id, room4.id])
+        self.assertFalse(second['more'])
+
+        last = self.client.get(reverse('room-sync'), {'since': second['sync_token']},
+                               format='json').data
+        self.assertFalse(last['more'])
+        self.assertEqual(last['changed'], [])
+
+        response = self.client.get(reverse('room-sync'), {'since': '2019-02-02T16:26:00Z,x'},
+                                   format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_sync_query_count_does_not_grow_with_houses(self):
+        for number in range(5):
+            house = create_house(street_address='%d Pelham st' % number, city='Toronto',
+                                 country='Canada', furnace_temperature=30.0, owner=self.owner)
+            create_room(room_label='room1', room_temperature=20.0, house=house, owner=self.owner)
+        # Houses with their owners, then all of their rooms.
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('house-sync'), format='json')
+        self.assertEqual(len(response.data['changed']), 6)
+        # Rooms with their owners.
+        with self.assertNumQueries(1):
+            self.client.get(reverse('room-sync'), format='json')
+
+    def test_sync_reports_rooms_moved_through_house(self):
+        '''
+        Rooms attached to / detached from a house with PATCH show up as changed.
+        '''
+        other = create_house(
+                    street_address='1 Pelham st', 
+                    city='Toronto',
+                    country='Canada',
+                    furnace_temperature=30.0, 
+                    owner=self.owner)
+        Room.objects.update(modified=timezone.now() - timedelta(hours=1))
+        token = self.client.get(reverse('room-sync'), format='json').data['sync_token']
+        
+        self.client.force_authenticate(user=self.owner)
+        response = self.client.patch(reverse('house-detail', args=(self.house.id,)), 
+                                     {'rooms': [reverse('room-detail', args=(self.room1.id,))]}, 
+                                     format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.patch(reverse('house-detail', args=(other.id,)), 
+                                     {'rooms': [reverse('room-detail', args=(self.room1.id,))]}, 
+                                     format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        
+        response = self.client.get(reverse('room-sync'), {'since': token}, format='json')
+        self.assertEqual(sorted(room['id'] for room in response.data['changed']), 
+                         [self.room1.id, self.room2.id])
+        
+        
+        
+class BulkOnboardingTests(APITestCase):
+    
+    def setUp(self):
+        self.owner = create_user(
+                    username='sam', 
+                    password='nimda123', email='sam@gmail.com')
+        self.client.force_authenticate(user=self.owner)
+        
+    def test_bulk_create_houses_with_rooms(self):
+        '''
+        Houses and their rooms are created in one request; furnace temperatures
+        start out at the energy saver value.
+        '''
+        payload = [
+            {'street_address': '9 London st', 'city': 'St. Catharines', 'country': 'Canada',
+             'furnace_temperature': 34.0, 'furnace_status': 'HEAT',
+             'rooms': [{'room_label': 'room1', 'room_temperature': 29.0},
+                       {'room_label': 'room2', 'room_temperature': 25.0, 'light_status': 'ON'}]},
+            {'street_address': '1 Pelham st', 'city': 'Toronto', 'country': 'Canada',
+             'furnace_temperature': 30.0, 'furnace_status': 'FAN',
+             'rooms': [{'room_label': 'room1', 'room_temperature': 22.0},
+                       {'room_label': 'room2', 'room_temperature': 21.5}]},
+            {'city': 'Ottawa', 'furnace_temperature': 20.0},
+        ]
+        response = self.client.post(reverse('house-bulk'), payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.data['houses']), 3)
+        self.assertEqual(response.data['rooms'], 4)
+        
+        heat, fan, empty = House.objects.filter(id__in=response.data['houses']).order_by('id')
+        self.assertEqual(heat.furnace_temperature, 29.0)
+        self.assertEqual(fan.furnace_temperature, 21.5)
+        self.assertEqual(empty.furnace_temperature, 20.0)
+        self.assertEqual(heat.rooms.count(), 2)
+        self.assertEqual(Room.objects.filter(owner=self.owner).count(), 4)
+        
+    def test_bulk_create_rejects_duplicate_room_labels(self):
+        '''
+        Nothing is written if any house in the payload is invalid.
+        '''
+        payload = [
+            {'city': 'Ottawa', 'furnace_temperature': 20.0, 
+             'rooms': [{'room_label': 'room1', 'room_temperature': 22.0}]},
+            {'city': 'Toronto', 'furnace_temperature': 20.0,
+             'rooms': [{'room_label': 'room1', 'room_temperature': 22.0},
+                       {'room_label': 'room1', 'room_temperature': 21.0}]},
+        ]
+        response = self.client.post(reverse('house-bulk'), payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(House.objects.count(), 0)
+        self.assertEqual(Room.objects.count(), 0)
+        
         
         
+class SummaryCounterAPITests(APITestCase):
+    
+    def test_attaching_rooms_updates_counters(self):
+        '''
+        Rooms attached through the house endpoint are counted on the house.
+        '''
+        owner = create_user(
+                    username='sam', 
+                    password='nimda123', email='sam@gmail.com')
+        house = create_house(
+                    street_address='9 London st', 
+                    city='St. Catharines',
+                    country='Canada',
+                    furnace_temperature=34.0, 
+                    owner=owner)
+        room = create_room(
+                    room_label='room1', 
+                    room_temperature=27.0, 
+                    house=None, 
+                    owner=owner)
+        self.client.force_authenticate(user=owner)
+        
+        response = self.client.patch(reverse('house-detail', args=(house.id,)), 
+                                     {'rooms': [reverse('room-detail', args=(room.id,))]}, 
+                                     format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['room_count'], 1)
+        
+        response = self.client.get(reverse('user-detail', args=(owner.id,)), format='json')
+        self.assertEqual(response.data['summary']['house_count'], 1)
+        self.assertEqual(response.data['summary']['room_count'], 1)
+        
+    def test_counter_changes_reach_house_sync(self):
+        owner = create_user(
+                    username='sam', 
+                    password='nimda123', email='sam@gmail.com')
+        house = create_house(
+                    street_address='9 London st', 
+                    city='St. Catharines',
+                    country='Canada',
+                    furnace_temperature=34.0, 
+                    owner=owner)
+        House.objects.update(modified=timezone.now() - timedelta(hours=1))
+        token = self.client.get(reverse('house-sync'), format='json').data['sync_token']
+        
+        create_room(room_label='room1', room_temperature=27.0, house=house, owner=owner)
+        response = self.client.get(reverse('house-sync'), {'since': token}, format='json')
+        self.assertEqual([(h['id'], h['room_count']) for h in response.data['changed']], 
+                         [(house.id, 1)])
+        
+        
+        
+class APIOnlyProfileTests(APITestCase):
+    '''
+    HomeAutomation.settings_api: JSON only, no browsable API or session stack.
+    DRF binds renderers/parsers to the view classes at import time, so the 
+    profile is exercised in a fresh interpreter started with those settings.
+    '''
+    PROBE = (
+        "import django, json\n"
+        "django.setup()\n"
+        "from django.test import Client\n"
+        "from django.test.utils import setup_test_environment\n"
+        "setup_test_environment()\n"
+        "client = Client()\n"
+        "html = client.get('/', HTTP_ACCEPT='text/html')\n"
+        "browser = client.get('/', HTTP_ACCEPT='text/html,*/*;q=0.8')\n"
+        "api = client.get('/', {'format': 'api'})\n"
+        "login = client.get('/api-auth/login/')\n"
+        "from hauto.views import HouseViewSet\n"
+        "print(json.dumps({\n"
+        "    'html': [html.status_code, html['Content-Type']],\n"
+        "    'browser': [browser.status_code, browser['Content-Type']],\n"
+        "    'api': api.status_code,\n"
+        "    'login': login.status_code,\n"
+        "    'renderers': [r.__name__ for r in HouseViewSet.renderer_classes],\n"
+        "    'parsers': [p.__name__ for p in HouseViewSet.parser_classes],\n"
+        "}))\n"
+    )
+    
+    def test_api_only_profile_serves_json_only(self):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE='HomeAutomation.settings_api')
+        probe = subprocess.run(
+            [sys.executable, '-c', self.PROBE], cwd=settings.BASE_DIR, env=env,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self.assertEqual(probe.returncode, 0, probe.stderr.decode())
+        result = json.loads(probe.stdout.decode().strip().splitlines()[-1])
+        
+        # Asking for HTML gets JSON back, never the browsable API.
+        self.assertEqual(result['html'], [status.HTTP_406_NOT_ACCEPTABLE, 'application/json'])
+        self.assertEqual(result['browser'], [status.HTTP_200_OK, 'application/json'])
+        self.assertEqual(result['api'], status.HTTP_404_NOT_FOUND)
+        self.assertEqual(result['login'], status.HTTP_404_NOT_FOUND)
+        self.assertEqual(result['renderers'], ['JSONRenderer'])
+        self.assertEqual(result['parsers'], ['JSONParser'])
+        
+        
+        
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRoutingTests(APITestCase):
+    '''
+    'default' and 'replica' are two separate SQLite databases here and nothing
+    replicates between them, so where a read was served from is visible.
+    '''
+    multi_db = True
+    
+    def setUp(self):
+        cache.clear()
+        self.owner = create_user(
+                    username='sam', 
+                    password='nimda123', email='sam@gmail.com')
+        self.house = create_house(
+                    street_address='9 London st', 
+                    city='St. Catharines',
+                    country='Canada',
+                    furnace_temperature=34.0, 
+                    owner=self.owner)
+        
+    def test_safe_reads_go_to_replica(self):
+        for name in ('house-list', 'room-list', 'user-list'):
+            response = self.client.get(reverse(name), format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.data['count'], 0)
+        
+        # Delta sync always reads from the primary.
+        response = self.client.get(reverse('house-sync'), format='json')
+        self.assertEqual(len(response.data['changed']), 1)
+        
+    def test_reads_stick_to_primary_after_a_write(self):
+        self.client.force_authenticate(user=self.owner)
+        response = self.client.get(reverse('house-list'), format='json')
+        self.assertEqual(response.data['count'], 0)
+        
+        response = self.client.post(reverse('room-list'), 
+                                    {'room_label': 'room1', 'room_temperature': 27.0}, 
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertFalse(Room.objects.using('replica').exists())
+        
+        response = self.client.get(reverse('room-list'), format='json')
+        self.assertEqual(response.data['count'], 1)
+        
+    def test_replica_reads_end_when_a_view_raises(self):
+        with mock.patch.object(HouseViewSet, 'list', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.client.get(reverse('house-list'), format='json')
+        self.assertEqual(routers.PrimaryReplicaRouter().db_for_read(House), 'default')
+        
+    @override_settings(DATABASE_REPLICAS=['replica', 'default'])
+    def test_replica_is_picked_once_per_request(self):
+        router = routers.PrimaryReplicaRouter()
+        with mock.patch('hauto.routers.random.choice', return_value='replica') as choice:
+            routers.set_replica_reads(True)
+            try:
+                aliases = {router.db_for_read(model) for model in (House, Room, User, House)}
+            finally:
+                routers.set_replica_reads(False)
+        self.assertEqual(aliases, {'replica'})
+        choice.assert_called_once_with(['replica', 'default'])
+        self.assertEqual(router.db_for_read(House), 'default')
+        
+    def test_mixins_work_in_any_order(self):
+        '''
+        Delta sync reads from the primary whatever the mixin order, and works
+        without replica routing at all.
+        '''
+        class ReplicaFirst(ReplicaReadMixin, DeltaSyncMixin, viewsets.ReadOnlyModelViewSet):
+            queryset = House.objects.all()
+            serializer_class = HouseSerializer
+            tombstone_model_name = 'house'
+            
+        class SyncOnly(DeltaSyncMixin, viewsets.ReadOnlyModelViewSet):
+            queryset = House.objects.all()
+            serializer_class = HouseSerializer
+            tombstone_model_name = 'house'
         
+        for viewset in (ReplicaFirst, SyncOnly):
+            request = APIRequestFactory().get('/houses/sync/')
+            response = viewset.as_view({'get': 'sync'})(request)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(len(response.data['changed']), 1)
         
-        
\ No newline at end of file
+    def test_energy_saver_aggregates_on_primary(self):
+        create_room(room_label='room1', room_temperature=29.0, house=self.house, owner=self.owner)
+        routers.set_replica_reads(True)
+        try:
+            self.house.furnace_status = 'HEAT'
+            self.house.save()
+        finally:
+            routers.set_replica_reads(False)
+        self.assertEqual(House.objects.get(pk=self.house.pk).furnace_temperature, 29.0)
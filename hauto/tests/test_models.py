@@ -1,8 +1,12 @@
 from django.test import TestCase
 from rest_framework.test import APIRequestFactory
 from rest_framework.test import APIClient
-from hauto.models import House, Room
+from hauto.models import House, OwnerSummary, Room
 from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from io import StringIO
 import json
 
 from django.urls import reverse
@@ -161,11 +165,173 @@ class UserHouseRoomModelsCreationTests(APITestCase):
         self.assertNotEqual(house.furnace_temperature, 25.0)
         
         
+
+class SummaryCounterTests(APITestCase):
+    
+    def setUp(self):
+        self.owner = create_user(
+                    username='sam', 
+                    password='nimda123', email='sam@gmail.com')
+        self.house = create_house(
+                    street_address='9 London st', 
+                    city='St. Catharines',
+                    country='Canada',
+                    furnace_status='OFF',
+                    furnace_temperature=34.0, 
+                    owner=self.owner)
+        self.room1 = create_room(
+                    room_label='room1', 
+                    room_temperature=29.0, 
+                    house=self.house, 
+                    owner=self.owner)
+        self.room2 = create_room(
+                    room_label='room2', 
+                    room_temperature=25.0, 
+                    house=self.house, 
+                    owner=self.owner)
+        
+    def assertCounters(self, house, room_count, lights_on_count):
+        house = House.objects.get(pk=house.pk)
+        self.assertEqual((house.room_count, house.lights_on_count), (room_count, lights_on_count))
+        
+    def assertSummary(self, **expected):
+        summary = OwnerSummary.objects.get(owner=self.owner)
+        self.assertEqual({f: getattr(summary, f) for f in expected}, expected)
+        
+    def test_counters_follow_saves(self):
+        self.assertCounters(self.house, 2, 0)
+        self.assertSummary(house_count=1, room_count=2, lights_on_count=0)
+        
+        self.room1.light_status = 'ON'
+        self.room1.save()
+        self.room1.save()
+        self.assertCounters(self.house, 2, 1)
+        self.assertSummary(lights_on_count=1)
+        
+        # Saving a stale house instance must not write old counters back.
+        self.house.furnace_status = 'HEAT'
+        self.house.save()
+        self.assertCounters(self.house, 2, 1)
+        self.assertSummary(furnaces_heating_count=1, furnaces_fan_count=0)
         
+        self.house.furnace_status = 'FAN'
+        self.house.save()
+        self.assertSummary(furnaces_heating_count=0, furnaces_fan_count=1)
         
+        # Move a lit room to another house.
+        other = create_house(
+                    street_address='1 Pelham st', 
+                    city='Toronto',
+                    country='Canada',
+                    furnace_status='OFF',
+                    furnace_temperature=20.0, 
+                    owner=self.owner)
+        self.room1.house = other
+        self.room1.save()
+        self.assertCounters(self.house, 1, 0)
+        self.assertCounters(other, 1, 1)
+        self.assertSummary(house_count=2, room_count=2, lights_on_count=1)
+        
+    def test_counters_ignore_stale_instances(self):
+        '''
+        Two requests load the same room and both switch its light ON; then 
+        both delete it. The counters follow what is stored, not the copies.
+        '''
+        first = Room.objects.get(pk=self.room1.pk)
+        second = Room.objects.get(pk=self.room1.pk)
+        first.light_status = 'ON'
+        first.save()
+        second.light_status = 'ON'
+        second.save()
+        self.assertCounters(self.house, 2, 1)
+        self.assertSummary(lights_on_count=1)
+        
+        first.delete()
+        second.delete()
+        self.assertCounters(self.house, 1, 0)
+        self.assertSummary(room_count=1, lights_on_count=0)
+        
+    def test_counters_follow_deletes(self):
+        self.room2.delete()
+        self.assertCounters(self.house, 1, 0)
+        self.assertSummary(house_count=1, room_count=1)
+        
+        # Cascade: the remaining room goes with the house.
+        self.house.delete()
+        self.assertSummary(house_count=0, room_count=0, lights_on_count=0)
+        
+        self.owner.delete()
+        self.assertFalse(OwnerSummary.objects.exists())
         
+    def test_counters_lock_house_before_summary(self):
+        '''
+        Room saves update the house counters before the owner summary, the 
+        same order House.save locks them in, so the two can not deadlock.
+        '''
+        self.room1.light_status = 'ON'
+        with CaptureQueriesContext(connection) as queries:
+            self.room1.save()
+        updates = [query['sql'] for query in queries.captured_queries 
+                   if query['sql'].startswith('UPDATE "hauto_house"') 
+                   or query['sql'].startswith('UPDATE "hauto_ownersummary"')]
+        self.assertEqual(len(updates), 2)
+        self.assertTrue(updates[0].startswith('UPDATE "hauto_house"'))
         
+    def test_counters_recreate_missing_summary(self):
+        '''
+        Owners without a summary row get one before the counters move.
+        '''
+        OwnerSummary.objects.all().delete()
+        self.room1.light_status = 'ON'
+        self.room1.save()
+        self.assertSummary(lights_on_count=1)
         
+    def test_counters_follow_bulk_onboarding(self):
+        House.objects.onboard([
+            {'city': 'Ottawa', 'furnace_temperature': 20.0, 'furnace_status': 'HEAT',
+             'owner': self.owner,
+             'rooms': [{'room_label': 'room1', 'room_temperature': 22.0, 'light_status': 'ON'},
+                       {'room_label': 'room2', 'room_temperature': 21.0}]},
+        ])
+        ottawa = House.objects.get(city='Ottawa')
+        self.assertCounters(ottawa, 2, 1)
+        self.assertSummary(house_count=2, room_count=4, lights_on_count=1, furnaces_heating_count=1)
         
+    def test_rebuild_summaries_repairs_drift(self):
+        House.objects.update(room_count=99)
+        OwnerSummary.objects.update(house_count=99, room_count=-3)
+        untouched = create_house(
+                    street_address='1 Pelham st', 
+                    city='Toronto',
+                    country='Canada',
+                    furnace_status='OFF',
+                    furnace_temperature=20.0, 
+                    owner=self.owner)
+        modified = House.objects.get(pk=untouched.pk).modified
+        call_command('rebuild_summaries', stdout=StringIO())
+        self.assertCounters(self.house, 2, 0)
+        # Houses whose counts were right are not marked modified.
+        self.assertEqual(House.objects.get(pk=untouched.pk).modified, modified)
+        self.assertSummary(house_count=2, room_count=2, lights_on_count=0)
         
-        
\ No newline at end of file
+    def test_rebuild_summaries_updates_rows_in_place(self):
+        '''
+        Concurrent counter bumps rely on the summary rows staying put; only 
+        missing rows are created.
+        '''
+        other = create_user(username='kim', password='nimda123', email='kim@gmail.com')
+        create_house(
+                    street_address='1 Pelham st', 
+                    city='Toronto',
+                    country='Canada',
+                    furnace_status='HEAT',
+                    furnace_temperature=20.0, 
+                    owner=other)
+        OwnerSummary.objects.filter(owner=other).delete()
+        with CaptureQueriesContext(connection) as queries:
+            call_command('rebuild_summaries', stdout=StringIO())
+        self.assertFalse([query for query in queries.captured_queries 
+                          if query['sql'].startswith('DELETE')])
+        self.assertSummary(house_count=1, room_count=2)
+        summary = OwnerSummary.objects.get(owner=other)
+        self.assertEqual((summary.house_count, summary.furnaces_heating_count), (1, 1))
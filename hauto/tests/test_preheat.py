@@ -0,0 +1,140 @@
+from datetime import timedelta
+from io import StringIO
+
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from hauto.models import FurnacePlan, House, Room, RoomTemperatureReading
+from hauto import preheat
+
+#===============================================================================
+# Predictive pre-heating: the vectorized planner maths, the temperature history
+# it learns from, and the batch job.
+#===============================================================================
+
+def create_user(username, password, email):
+    return User.objects.create_user(
+        username=username, 
+        password=password, 
+        email=email)
+    
+def create_house(street_address, city, country, furnace_status, furnace_temperature, owner):
+    return House.objects.create(
+        street_address=street_address, 
+        city=city, country=country, 
+        furnace_status=furnace_status,
+        furnace_temperature=furnace_temperature, 
+        owner=owner)
+    
+def create_room(room_label, room_temperature, house, owner):
+    return Room.objects.create(
+        room_label=room_label,
+        room_temperature=room_temperature,
+        house=house,
+        owner=owner)
+    
+    
+
+class PlannerMathTests(APITestCase):
+    
+    def test_learn_rates(self):
+        '''
+        House 0: room 1 warms 2deg in 1h then 2deg in 3h (heat 4deg/4h), room 2 
+            cools 3deg in 2h. House 1 has a single reading -> defaults.
+        The jump between room 1 and room 2 is not a rate.
+        '''
+        house_index = [0, 0, 0, 0, 0, 1]
+        room_ids = [1, 1, 1, 2, 2, 3]
+        seconds = [0, 3600, 4 * 3600, 0, 2 * 3600, 0]
+        temperatures = [20, 22, 24, 25, 22, 20]
+        heat, cool = preheat.learn_rates(house_index, room_ids, seconds, temperatures, 2)
+        np.testing.assert_allclose(heat, [1.0, preheat.DEFAULT_HEAT_RATE])
+        np.testing.assert_allclose(cool, [1.5, preheat.DEFAULT_COOL_RATE])
+        
+    def test_learn_rates_skips_idle_gaps(self):
+        '''
+        Room 1 heats 2deg in 1h, then drifts 1deg over a 24h idle night: the
+        night must not drag the heat rate down, and is not a cool rate either.
+        '''
+        heat, cool = preheat.learn_rates(
+            [0, 0, 0], [1, 1, 1], [0, 3600, 25 * 3600], [20, 22, 23], 1)
+        np.testing.assert_allclose(heat, [2.0])
+        np.testing.assert_allclose(cool, [preheat.DEFAULT_COOL_RATE])
+        heat, _ = preheat.learn_rates(
+            [0, 0, 0], [1, 1, 1], [0, 3600, 25 * 3600], [20, 22, 23], 1, max_gap_hours=48)
+        np.testing.assert_allclose(heat, [3.0 / 25])
+        
+    def test_plan(self):
+        '''
+        Heat 20->26 at 2deg/h starts 3h early; fan 30->25 at 1deg/h would need
+        5h but only 4h are left, so it starts now; an in-range or empty house 
+        stays OFF.
+        '''
+        now, ready_by = 0.0, 4 * 3600.0
+        status, setpoint, start = preheat.plan(
+            current=[20, 30, 22, 22],
+            max_temps=[26, 28, 22, np.nan],
+            min_temps=[21, 25, 22, np.nan],
+            heat_rates=[2.0, 2.0, 2.0, 2.0],
+            cool_rates=[1.0, 1.0, 1.0, 1.0],
+            ready_by=ready_by, now=now)
+        self.assertEqual(list(status), [preheat.HEAT, preheat.FAN, preheat.OFF, preheat.OFF])
+        np.testing.assert_allclose(setpoint[:2], [26, 25])
+        np.testing.assert_allclose(start[:2], [3600.0, now])
+        self.assertTrue(np.isnan(start[2:]).all())
+        
+        
+        
+class PreheatingJobTests(APITestCase):
+    
+    def setUp(self):
+        self.owner = create_user(
+                    username='sam', 
+                    password='nimda123', email='sam@gmail.com')
+        self.house = create_house(
+                    street_address='9 London st', 
+                    city='St. Catharines',
+                    country='Canada',
+                    furnace_status='OFF',
+                    furnace_temperature=20.0, 
+                    owner=self.owner)
+        self.room = create_room(
+                    room_label='room1', 
+                    room_temperature=20.0, 
+                    house=self.house, 
+                    owner=self.owner)
+        
+    def test_room_temperature_changes_are_recorded(self):
+        room = Room.objects.get(pk=self.room.pk)
+        room.light_status = 'ON'
+        room.save()
+        room.room_temperature = 23.0
+        room.save()
+        temperatures = RoomTemperatureReading.objects.filter(room=room).values_list(
+            'temperature', flat=True)
+        self.assertEqual([float(t) for t in temperatures], [20.0, 23.0])
+        
+    def test_plan_preheating_command(self):
+        '''
+        Learns 2deg/h from history, then plans heating to the warmest room.
+        '''
+        now = timezone.now()
+        RoomTemperatureReading.objects.all().delete()
+        RoomTemperatureReading.objects.bulk_create([
+            RoomTemperatureReading(room=self.room, house=self.house, temperature=18.0, 
+                                   recorded=now - timedelta(hours=3)),
+            RoomTemperatureReading(room=self.room, house=self.house, temperature=22.0, 
+                                   recorded=now - timedelta(hours=1)),
+        ])
+        create_room(room_label='room2', room_temperature=24.0, house=self.house, owner=self.owner)
+        ready_by = now + timedelta(hours=5)
+        
+        call_command('plan_preheating', ready_by=ready_by.isoformat(), stdout=StringIO())
+        plan = FurnacePlan.objects.get(house=self.house)
+        self.assertEqual(plan.furnace_status, House.HEAT)
+        self.assertEqual(float(plan.setpoint), 24.0)
+        self.assertAlmostEqual(plan.heat_rate, 2.0)
+        self.assertAlmostEqual((ready_by - plan.start).total_seconds(), 2 * 3600, places=0)
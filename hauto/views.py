@@ -1,45 +1,214 @@
+from datetime import timedelta
+
+from django.conf import settings
 from django.contrib.auth.models import User
-from rest_framework import generics, permissions, renderers, viewsets
-from hauto.models import House, Room
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework import permissions, status, viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+from hauto import routers
+from hauto.models import House, Room, Tombstone
 from hauto.permissions import IsOwnerOrReadOnly
-from hauto.serializers import HouseSerializer, RoomSerializer, UserSerializer
+from hauto.serializers import (
+    BulkHouseSerializer, HouseSerializer, RoomSerializer, UserSerializer)
+
+
+def parse_sync_token(param, value):
+    '''
+    Sync tokens are plain UTC ISO-8601 timestamps, eg. 2019-02-02T16:26:00.000000Z
+    '''
+    try:
+        since = parse_datetime(value)
+    except ValueError:
+        since = None
+    if since is None:
+        raise ValidationError({param: 'Expected an ISO-8601 timestamp.'})
+    if timezone.is_naive(since):
+        since = timezone.make_aware(since, timezone.utc)
+    return since
+
+
+def format_sync_token(value):
+    return value.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+def parse_sync_cursor(param, value):
+    '''
+    A sync token, followed by `,<id>` when it continues a paged sync:
+        the timestamp and id of the last record already returned.
+    '''
+    value, _, after_id = value.partition(',')
+    since = parse_sync_token(param, value)
+    if not after_id:
+        return since, None
+    if not after_id.isdigit():
+        raise ValidationError({param: 'Expected an id after the timestamp.'})
+    return since, int(after_id)
 
 
-class HouseViewSet(viewsets.ModelViewSet):
+class ReplicaReadMixin(object):
+    """
+    Serve safe-method requests from a read replica (settings.DATABASE_REPLICAS),
+    except for users who wrote something in the last few seconds, and for the
+    actions / query parameters that must see the primary.
+    Those are read from optional `primary_only_actions` / `primary_only_params`
+    attributes (not defaulted here, so other mixins can set them in any order).
+    """
+    def use_replica(self, request):
+        if getattr(self, 'action', None) in getattr(self, 'primary_only_actions', ()):
+            return False
+        if any(param in request.query_params 
+               for param in getattr(self, 'primary_only_params', ())):
+            return False
+        return (request.method in permissions.SAFE_METHODS 
+                and not routers.is_pinned(request.user))
+    
+    def dispatch(self, request, *args, **kwargs):
+        # Whatever happens in the handler, the worker thread must not keep
+        # reading from a replica afterwards.
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            routers.set_replica_reads(False)
+    
+    def initial(self, request, *args, **kwargs):
+        # After authentication, which always reads from the primary.
+        super().initial(request, *args, **kwargs)
+        routers.set_replica_reads(self.use_replica(request))
+        
+    def finalize_response(self, request, response, *args, **kwargs):
+        if request.method not in permissions.SAFE_METHODS and response.status_code < 400:
+            routers.pin_to_primary(request.user)
+        return super().finalize_response(request, response, *args, **kwargs)
+    
+    
+class DeltaSyncMixin(object):
+    """
+    Delta sync on top of the `modified` timestamp.
+    `?modified_since=<timestamp>` narrows the list to records changed since then.
+    `sync/?since=<token>` returns the changed records plus the ids deleted since
+    the token, and a fresh `sync_token` to send on the next call.
+    Records come in pages of settings.SYNC_PAGE_SIZE, ordered by (modified, id);
+    while `more` is true the `sync_token` is a continuation token, and the
+    client keeps calling with it until it has caught up.
+    
+    `modified` is stamped in Python before the write commits, so a row can 
+    become visible after a sync that ran later than its stamp. Issued tokens 
+    are therefore set back by settings.SYNC_TOKEN_MARGIN_SECONDS: such rows 
+    are picked up by the next sync, at the price of clients receiving some 
+    records (and deletions) twice. Clients must apply changes idempotently.
+    """
+    tombstone_model_name = None
+    
+    # A lagging replica would hand out a sync token past changes it has not
+    # received yet, and the client would never see them (see ReplicaReadMixin).
+    primary_only_actions = ('sync',)
+    primary_only_params = ('modified_since',)
+    
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        modified_since = self.request.query_params.get('modified_since')
+        if modified_since and self.action == 'list':
+            since = parse_sync_token('modified_since', modified_since)
+            queryset = queryset.filter(modified__gte=since)
+        return queryset
+    
+    @action(detail=False)
+    def sync(self, request):
+        # Taken before querying, minus the margin for writes still in flight.
+        sync_token = timezone.now() - timedelta(
+            seconds=getattr(settings, 'SYNC_TOKEN_MARGIN_SECONDS', 5))
+        page_size = getattr(settings, 'SYNC_PAGE_SIZE', 500)
+        queryset = self.get_queryset().order_by('modified', 'id')
+        deleted = []
+        since = request.query_params.get('since')
+        if since:
+            since, after_id = parse_sync_cursor('since', since)
+            if after_id is None:
+                queryset = queryset.filter(modified__gte=since)
+            else:
+                queryset = queryset.filter(
+                    Q(modified__gt=since) | Q(modified=since, id__gt=after_id))
+            # Deletions can't be paged; each page repeats those since its token.
+            deleted = Tombstone.objects.filter(
+                model_name=self.tombstone_model_name,
+                deleted__gte=since).values_list('object_id', flat=True)
+        
+        changed = list(queryset[:page_size + 1])
+        more = len(changed) > page_size
+        if more:
+            changed = changed[:page_size]
+            last = changed[-1]
+            token = '%s,%d' % (format_sync_token(last.modified), last.id)
+        else:
+            token = format_sync_token(sync_token)
+        serializer = self.get_serializer(changed, many=True)
+        return Response({
+            'sync_token': token,
+            'more': more,
+            'changed': serializer.data,
+            'deleted': list(deleted),
+        })
+        
+
+class HouseViewSet(DeltaSyncMixin, ReplicaReadMixin, viewsets.ModelViewSet):
     """
     This viewset automatically provides `list`, `create`, `retrieve`,
-    `update` and `destroy` actions.
+    `update` and `destroy` actions, plus delta `sync`.
     """
-    queryset = House.objects.all()
+    queryset = House.objects.select_related('owner').prefetch_related('rooms')
     serializer_class = HouseSerializer
     permission_classes = (
         permissions.IsAuthenticatedOrReadOnly,
         IsOwnerOrReadOnly, 
     )
+    tombstone_model_name = Tombstone.HOUSE
+    
+    def get_serializer_class(self):
+        if self.action == 'bulk':
+            return BulkHouseSerializer
+        return super().get_serializer_class()
     
     def perform_create(self, serializer):
         serializer.save(owner=self.request.user)
         
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        '''
+        Onboard many houses, each with its rooms, in a single transaction.
+        '''
+        serializer = self.get_serializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        houses = serializer.save(owner=request.user)
+        return Response({
+            'houses': [house.id for house in houses],
+            'rooms': sum(len(data.get('rooms') or []) for data in serializer.validated_data),
+        }, status=status.HTTP_201_CREATED)
+        
         
-class RoomViewSet(viewsets.ModelViewSet):
+class RoomViewSet(DeltaSyncMixin, ReplicaReadMixin, viewsets.ModelViewSet):
     """
     """
-    queryset = Room.objects.all()
+    queryset = Room.objects.select_related('owner')
     serializer_class = RoomSerializer
     permission_classes = (
         permissions.IsAuthenticatedOrReadOnly,
         IsOwnerOrReadOnly, 
     )
+    tombstone_model_name = Tombstone.ROOM
     
     def perform_create(self, serializer):
         serializer.save(owner=self.request.user)
            
 
-class UserViewSet(viewsets.ReadOnlyModelViewSet):
+class UserViewSet(ReplicaReadMixin, viewsets.ReadOnlyModelViewSet):
     """
     This viewset automatically provides `list` and `detail` actions.
     """
-    queryset = User.objects.get_queryset().order_by('id')
+    queryset = User.objects.get_queryset().select_related('summary').order_by('id')
     serializer_class = UserSerializer
  
-    
\ No newline at end of file
+    